@@ -1,17 +1,147 @@
 import asyncio
 import os
-import json
 from typing import Optional, List
 from contextlib import AsyncExitStack
 from datetime import datetime
 import re
-from openai import OpenAI
+import orjson
+from openai import AsyncOpenAI
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# 预编译的正则表达式
+_KEYWORD_RE = re.compile(r"(关于|分析|查询|搜索|查看)([^的\s，。？、\n]+)")
+_UNSAFE_CHARS_RE = re.compile(r'[\\/:*?"<>|]')
+_REF_RE = re.compile(r"^\{\{\s*([^}\s]+)\s*\}\}\Z")
+
+# 已创建过的输出目录，避免每次调用重复创建
+_ENSURED_DIRS: set[str] = set()
+
+
+def _ensure_dir(path: str) -> None:
+    """
+    确保目录存在，每个目录在进程内只创建一次
+    :param path: 目录路径
+    """
+    if path not in _ENSURED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _ENSURED_DIRS.add(path)
+
+
+def _find_deps(step: dict) -> set:
+    """
+    找出工具调用步骤所依赖的前序工具
+    :param step: 工具调用步骤，包含 name 和 arguments
+    :return: 被依赖的工具名集合
+    """
+    deps = {
+        m.group(1)
+        for val in step["arguments"].values()
+        if isinstance(val, str) and (m := _REF_RE.match(val))
+    }
+    # 自动注入的附件路径指向情感分析生成的报告，需等待其写入完成
+    if (
+            step["name"] == "send_email_with_attachment"
+            and "attachment_path" not in step["arguments"]
+    ):
+        deps.add("analyze_sentiment")
+    return deps
+
+
+def _must_wait(prev: dict, step: dict) -> bool:
+    """
+    判断步骤是否需要等待规划中位于其前面的步骤执行完毕
+    :param prev: 前面的步骤
+    :param step: 当前步骤
+    :return: 是否需要等待
+    """
+    return (
+            prev["name"] in _find_deps(step)  # 读取前面步骤的结果
+            or step["name"] in _find_deps(prev)  # 会覆盖前面步骤仍需读取的结果
+            or step["name"] == prev["name"]  # 写入同一结果，需保持先后顺序
+    )
+
+
+def _write_record(file_path: str, query: str, final_output: str) -> None:
+    """
+    将查询和大模型回复写入文件（阻塞，需在线程中调用）
+    """
+    payload = f"用户输入：{query}\n模型回复：{final_output}\n".encode("utf-8")
+    with open(file_path, "wb") as f:
+        f.write(payload)
+
+
+async def _collect_stream(stream, echo: bool = False) -> str:
+    """
+    逐块接收流式响应并拼接为完整文本
+    :param stream: chat.completions 的流式响应
+    :param echo: 是否在接收时实时打印
+    :return: 完整的响应文本
+    """
+    parts = []
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            delta = chunk.choices[0].delta.content
+            parts.append(delta)
+            if echo:
+                print(delta, end="", flush=True)
+    if echo:
+        print()
+    return "".join(parts)
+
+
+def _match_bracket(text: str, start: int) -> Optional[int]:
+    """
+    从 start 处的 [ 开始单遍扫描，找出与之配对的 ]
+    :param text: 待扫描文本
+    :param start: [ 所在位置
+    :return: 配对 ] 的位置，未配对时返回None
+    """
+    depth, in_str, esc = 0, False, False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif c == "\\":
+                esc = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "[":
+            depth += 1
+        elif c == "]":
+            depth -= 1
+            if depth == 0:
+                return i
+    return None
+
+
+def _extract_json_array(text: str) -> Optional[str]:
+    """
+    找出文本中第一个可解析为列表的JSON数组，跳过 [txt_filename:...] 等非JSON的方括号内容
+    :param text: 模型返回的文本，可能包含markdown标记或说明文字
+    :return: JSON数组文本，数组不完整时返回None
+    """
+    start = text.find("[")
+    while start >= 0:
+        end = _match_bracket(text, start)
+        if end is None:
+            # 数组尚未接收完整
+            return None
+        candidate = text[start:end + 1]
+        try:
+            if isinstance(orjson.loads(candidate), list):
+                return candidate
+        except orjson.JSONDecodeError:
+            pass
+        start = text.find("[", start + 1)
+    return None
+
 
 class MCPClient:
     def __init__(self):
@@ -21,8 +151,12 @@ class MCPClient:
         self.model = os.getenv("MODEL")
         if not self.openai_api_key:
             raise ValueError("未找到OPENAI_API_KEY环境变量，请在.env文件中设置。")
-        self.client = OpenAI(api_key=self.openai_api_key, base_url=self.base_url)
+        self.client = AsyncOpenAI(api_key=self.openai_api_key, base_url=self.base_url)
         self.session: Optional[ClientSession] = None
+        self._available_tools: List[dict] = []
+        self._tools_json: str = "[]"
+        self._tool_list_text: str = ""
+        self._planner_system_prompt: dict = {}
 
     async def connect_to_server(self, server_script_path: str):
         is_python = os.path.splitext(server_script_path)[-1] == ".py"
@@ -50,11 +184,8 @@ class MCPClient:
         response = await self.session.list_tools()
         tools = response.tools
         print("MCP服务器支持以下工具:", [tool.name for tool in tools])
-
-    async def process_query(self, query: str) -> str:
-        # 获取工具列表
-        response = await self.session.list_tools()
-        available_tools = [
+        # 会话期间工具列表不变，缓存供每次查询使用
+        self._available_tools = [
             {
                 "type": "function",
                 "function": {
@@ -63,14 +194,38 @@ class MCPClient:
                     "input_schema": tool.inputSchema,
                 },
             }
-            for tool in response.tools
+            for tool in tools
         ]
-        # 提取用户查询关键词，生成文件名
-        keyword_match = re.search(
-            r"(关于|分析|查询|搜索|查看)([^的\s，。？、\n]+)", query
+        self._tools_json = orjson.dumps(
+            self._available_tools, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        ).decode()
+        self._tool_list_text = "\n".join(
+            [
+                f"--{tool['function']['name']}: {tool['function']['description']}"
+                for tool in self._available_tools
+            ]
         )
+        # 构造全局提示，工具列表不变，连接时构造一次即可
+        self._planner_system_prompt = {
+            "role": "system",
+            "content": (
+                "你是一个智能任务规划助手，用户会给出自然语言请求。\n"
+                "你只能从以下工具中选择（严格使用工具名称）：\n"
+                f"{self._tool_list_text}\n"
+                "如果需多个工具串联使用，后续步骤中可以使用 {{上一步工具名}} 占位。\n"
+                "返回格式：JSON数组，每个元素是一个对象，包含 name 和 arguments 两个字段，name 是工具名，arguments 是工具参数。\n"
+                ""
+                "不要返回自然语言，不要使用未列出的工具名。\n"
+            ),
+        }
+
+    async def process_query(self, query: str) -> str:
+        available_tools = self._available_tools
+        # 提取用户查询关键词，生成文件名
+        keyword_match = _KEYWORD_RE.search(query)
         keyword = keyword_match.group(2) if keyword_match else "分析对象"
-        safe_keyword = re.sub(r'[\\/:*?"<>|]', "", keyword)[:20]
+        safe_keyword = _UNSAFE_CHARS_RE.sub("", keyword)[:20]
+        # 本次查询生成的所有文件共用同一个时间戳
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         txt_filename = f"sentiment_{safe_keyword}_{timestamp}.txt"
         txt_path = os.path.join("sentiment_report", txt_filename)
@@ -81,57 +236,70 @@ class MCPClient:
         messages = [{"role": "user", "content": new_query}]
         tool_plan = await self.plan_tool_use(new_query, available_tools)
         tool_outputs = {}
-        # 依次执行工具
-        for step in tool_plan:
-            tool_name = step["name"]
-            tool_args = step["arguments"]
-            # 参数动态绑定，使得后续工具可以把前面工具的返回结果当参数
-            for key, val in tool_args.items():
-                if isinstance(val, str) and val.startswith("{{") and val.endswith("}}"):
-                    ref_key = val.strip("{} ")
-                    resolved_val = tool_outputs.get(ref_key, None)
-                    tool_args[key] = resolved_val
-            # 注入统一的文件名和路径
-            if tool_name == "analyze_sentiment" and "filename" not in tool_args:
-                tool_args["filename"] = txt_filename
-            if (
-                    tool_name == "send_email_with_attachment"
-                    and "attachment_path" not in tool_args
-            ):
-                tool_args["attachment_path"] = txt_path
-
-            result = await self.session.call_tool(tool_name, tool_args)
-            tool_outputs[tool_name] = result.content[0].text  # 记录工具返回结果
+        step_results = {}
+        # 按依赖关系分批执行工具，同一批内的工具互不依赖，可以并发调用
+        pending = list(enumerate(tool_plan))
+        while pending:
+            wave = [
+                (pos, step)
+                for i, (pos, step) in enumerate(pending)
+                if not any(_must_wait(prev, step) for _, prev in pending[:i])
+            ]
+            for _, step in wave:
+                tool_name = step["name"]
+                tool_args = step["arguments"]
+                # 参数动态绑定，使得后续工具可以把前面工具的返回结果当参数
+                for key, val in list(tool_args.items()):
+                    if isinstance(val, str) and (m := _REF_RE.match(val)):
+                        tool_args[key] = tool_outputs.get(m.group(1))
+                # 注入统一的文件名和路径
+                if tool_name == "analyze_sentiment" and "filename" not in tool_args:
+                    tool_args["filename"] = txt_filename
+                if (
+                        tool_name == "send_email_with_attachment"
+                        and "attachment_path" not in tool_args
+                ):
+                    tool_args["attachment_path"] = txt_path
+
+            results = await asyncio.gather(
+                *[self.session.call_tool(step["name"], step["arguments"]) for _, step in wave]
+            )
+            for (pos, step), result in zip(wave, results):
+                tool_outputs[step["name"]] = result.content[0].text  # 记录工具返回结果
+                step_results[pos] = (step["name"], result.content[0].text)
+            done = {pos for pos, _ in wave}
+            pending = [(pos, step) for pos, step in pending if pos not in done]
+        # 按规划顺序记录工具结果
+        for pos in sorted(step_results):
+            tool_name, content = step_results[pos]
             messages.append(
                 {
                     "role": "tool",
                     "tool_call_id": tool_name,
-                    "content": result.content[0].text,
+                    "content": content,
                 }
             )
-        # 使用大模型生成汇总结果
-        final_result = self.client.chat.completions.create(
+        # 使用大模型生成汇总结果，流式输出
+        final_stream = await self.client.chat.completions.create(
             model=self.model,
             messages=messages,
+            stream=True,
         )
-        final_output = final_result.choices[0].message.content
+        final_output = await _collect_stream(final_stream, echo=True)
 
         # 获取文件名辅助函数
         def clean_filename(text: str) -> str:
             text = text.strip()
-            text = re.sub(r'[\\/:*?"<>|]', "", text)
+            text = _UNSAFE_CHARS_RE.sub("", text)
             return text[:50]
 
         # 存储查询和大模型回复
         safe_filename = clean_filename(query)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{safe_filename}_{timestamp}.txt"
         output_dir = "./llm_output"
-        os.makedirs(output_dir, exist_ok=True)
+        _ensure_dir(output_dir)
         file_path = os.path.join(output_dir, filename)
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(f"用户输入：{query}\n")
-            f.write(f"模型回复：{final_output}\n")
+        await asyncio.to_thread(_write_record, file_path, query, final_output)
         print(f"对话记录已保存到文件：{file_path}")
         return final_output
 
@@ -143,51 +311,38 @@ class MCPClient:
                 query = input("请输入内容：").strip()
                 if query == "quit":
                     break
-                response = await self.process_query(query)
-                print(response)
+                # 回复在生成时已流式打印
+                await self.process_query(query)
             except Exception as e:
                 print(f"发生错误：{str(e)}")
 
     async def plan_tool_use(self, query: str, tools: List[dict]) -> List[dict]:
         print("\n提交给大模型的工具有：")
-        print(json.dumps(tools, esure_ascii=False, indent=2))
-        tool_list_text = "\n".join(
-            [
-                f"--{tool['function']['name']}: {tool['function']['description']}"
-                for tool in tools
-            ]
-        )
-        # 构造全局提示
-        system_prompt = {
-            "role": "system",
-            "content": (
-                "你是一个智能任务规划助手，用户会给出自然语言请求。\n"
-                "你只能从以下工具中选择（严格使用工具名称）：\n"
-                f"{tool_list_text}\n"
-                "如果需多个工具串联使用，后续步骤中可以使用 {{上一步工具名}} 占位。\n"
-                "返回格式：JSON数组，每个元素是一个对象，包含 name 和 arguments 两个字段，name 是工具名，arguments 是工具参数。\n"
-                ""
-                "不要返回自然语言，不要使用未列出的工具名。\n"
-            ),
-        }
-
-        plan_messages = [system_prompt, {"role": "user", "content": query}]
-        plan_response = self.client.chat.completions.create(
+        print(self._tools_json)
+        plan_messages = [self._planner_system_prompt, {"role": "user", "content": query}]
+        plan_stream = await self.client.chat.completions.create(
             model=self.model,
             messages=plan_messages,
             tools=tools,
             tool_choice="none",
+            stream=True,
         )
+        # 模型返回的是JSON数组，收到完整数组后即可停止接收
+        parts = []
+        async for chunk in plan_stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            delta = chunk.choices[0].delta.content
+            parts.append(delta)
+            if "]" in delta and _extract_json_array("".join(parts)) is not None:
+                break
+        await plan_stream.close()
         # 提取模型响应中的JSON内容
-        content = plan_response.choices[0].message.content.strip()
-        match = re.search(r"(?:json)?\s*([\s\S]+?)\s*", content)
-        if match:
-            json_text = match.group(1)
-        else:
-            json_text = content
+        content = "".join(parts).strip()
+        json_text = _extract_json_array(content) or content
         # 解析json内容并返回
         try:
-            plan = json.loads(json_text)
+            plan = orjson.loads(json_text)
             return plan if isinstance(plan, list) else []
         except Exception as e:
             print(f"工具调用链规划失败，原始返回为：{content}")
@@ -208,4 +363,10 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # 优先使用uvloop事件循环，未安装时回退到asyncio默认事件循环
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
@@ -1,11 +1,12 @@
 import asyncio
-import json
 import logging
 import os
 
+import orjson
+
 from fastmcp import Client
 from fastmcp.client.transports import PythonStdioTransport
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 from dotenv import load_dotenv
 
@@ -15,40 +16,58 @@ load_dotenv()
 class LLMClient:
     def __init__(self, model_name: str, url: str, api_key: str) -> None:
         self.model_name = model_name
-        self.client = OpenAI(api_key=api_key, base_url=url)
+        self.client = AsyncOpenAI(api_key=api_key, base_url=url)
 
-    def get_response(self, messages: list[dict[str, str]]) -> str:
+    async def get_response(self, messages: list[dict[str, str]], echo: bool = False) -> str:
         """
-        发送消息给LLM并获取响应
+        发送消息给LLM并以流式方式获取响应
         :param messages: 发送的消息列表
+        :param echo: 是否在接收时实时打印响应
         :return: LLM的响应
         """
-        response = self.client.chat.completions.create(
+        stream = await self.client.chat.completions.create(
             model=self.model_name,
             messages=messages,
-            stream=False,
+            stream=True,
         )
-        return response.choices[0].message.content
+        parts = []
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                if echo:
+                    print(delta, end="", flush=True)
+        if echo:
+            print()
+        return "".join(parts)
 
 
 class ChatSession:
-    def __init__(self, llm_client: LLMClient, mcp_session: Client) -> None:
+    def __init__(self, llm_client: LLMClient, mcp_session: Client, tool_names: set[str] | None = None) -> None:
         self.llm_client: LLMClient = llm_client
         self.mcp_session: Client = mcp_session
+        self._tool_names: set[str] | None = tool_names
 
     async def process_llm_response(self, llm_response: str) -> str:
         """
         处理LLM响应，解析工具调用并执行
         """
         try:
-            # 移除可能得markdown格式
-            if llm_response.startswith("```json"):
-                llm_response = llm_response.strip("```json").strip("```").strip()
-            tool_call = json.loads(llm_response)
+            # 移除可能的markdown代码块标记
+            text = llm_response.strip()
+            if text.startswith("```json"):
+                text = text[7:]
+            elif text.startswith("```"):
+                text = text[3:]
+            if text.endswith("```"):
+                text = text[:-3]
+            tool_call = orjson.loads(text.strip())
             if "tool" in tool_call and "arguments" in tool_call:
-                # 检查工具列表是否包含该工具
-                tools = await self.mcp_session.list_tools()
-                if any(tool.name == tool_call["tool"] for tool in tools):
+                # 检查工具列表是否包含该工具，未提供工具名时首次使用获取并缓存
+                if self._tool_names is None:
+                    tools = await self.mcp_session.list_tools()
+                    self._tool_names = {tool.name for tool in tools}
+                if tool_call["tool"] in self._tool_names:
                     try:
                         result = await self.mcp_session.call_tool(tool_call["tool"], tool_call["arguments"])
                         return f"调用了{tool_call['tool']}工具，结果为{result.content[0].text}"
@@ -58,7 +77,7 @@ class ChatSession:
                         return error_msg
                 return f"没有该工具：{tool_call['tool']}"
             return llm_response
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # 非JSON格式直接返回LLM响应
             return llm_response
 
@@ -75,9 +94,9 @@ class ChatSession:
                     print("用户已退出")
                     break
                 messages.append({"role": "user", "content": user_input})
-                # LLM初始响应
-                llm_response = self.llm_client.get_response(messages)
-                print("助手：", llm_response)
+                # LLM初始响应，边生成边打印
+                print("助手：", end=" ", flush=True)
+                llm_response = await self.llm_client.get_response(messages, echo=True)
                 # 处理可能的工具调用
                 result = await self.process_llm_response(llm_response)
                 # 循环处理LLM响应中的工具调用
@@ -85,7 +104,7 @@ class ChatSession:
                     messages.append({"role": "assistant", "content": llm_response})
                     messages.append({"role": "system", "content": result})
                     # 将工具调用结果添加到消息列表中，获取新响应
-                    llm_response = self.llm_client.get_response(messages)
+                    llm_response = await self.llm_client.get_response(messages)
                     print("助手：", result)
                     result = await self.process_llm_response(llm_response)
 
@@ -102,8 +121,8 @@ async def main():
                                url=os.getenv("BASE_URL"))
         # 获取可用工具列表并格式化为提示词一部分
         tools = await session.list_tools()
-        dict_list = [tool.__dict__ for tool in tools]
-        tools_description = json.dumps(dict_list, ensure_ascii=False)
+        # Tool为pydantic模型，直接用其JSON序列化拼接，省去中间dict
+        tools_description = "[" + ",".join(tool.model_dump_json(exclude_none=True) for tool in tools) + "]"
         # 系统提示，指导LLM如何使用工具
         system_message = f'''
         你是一个智能助手，严格遵循以下协议返回响应。
@@ -149,9 +168,15 @@ async def main():
         - 可以使用用户问题中的合适上下文
         - 避免简单重复原始数据
         '''
-        chat_session = ChatSession(llm_client, session)
+        chat_session = ChatSession(llm_client, session, {tool.name for tool in tools})
         await chat_session.start(system_message)
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    # 优先使用uvloop事件循环，未安装时回退到asyncio默认事件循环
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
\ No newline at end of file
@@ -1,17 +1,129 @@
+import asyncio
+import mmap
 import os
-import json
-import smtplib
+from contextlib import asynccontextmanager
 from datetime import datetime
 from email.message import EmailMessage
+from pathlib import Path
 
+import aiosmtplib
 import httpx
+import orjson
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 load_dotenv()
 
-mcp = FastMCP("NewsServer")
+# 复用的HTTP客户端，保持连接池与keep-alive，首次使用时创建
+_HTTPX_CLIENT: httpx.AsyncClient | None = None
+
+
+def _client() -> httpx.AsyncClient:
+    global _HTTPX_CLIENT
+    if _HTTPX_CLIENT is None:
+        _HTTPX_CLIENT = httpx.AsyncClient(timeout=30.0)
+    return _HTTPX_CLIENT
+
+
+# 情感分析使用的LLM客户端，首次调用时创建，所有调用共享连接池
+_MODEL = os.getenv("MODEL")
+_OAI_CLIENT: AsyncOpenAI | None = None
+
+
+def _llm_client() -> AsyncOpenAI:
+    global _OAI_CLIENT
+    if _OAI_CLIENT is None:
+        _OAI_CLIENT = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("BASE_URL"))
+    return _OAI_CLIENT
+
+
+# 复用的SMTP长连接，首次发送时建立并登录，断开后自动重连
+_SMTP_CLIENT: aiosmtplib.SMTP | None = None
+_SMTP_LOCK = asyncio.Lock()
+
+
+async def _smtp(smtp_server: str, smtp_port: int, sender_email: str, sender_pass: str) -> aiosmtplib.SMTP:
+    global _SMTP_CLIENT
+    if _SMTP_CLIENT is None or not _SMTP_CLIENT.is_connected:
+        smtp = aiosmtplib.SMTP(hostname=smtp_server, port=smtp_port, use_tls=True)
+        await smtp.connect()
+        try:
+            await smtp.login(sender_email, sender_pass)
+        except Exception:
+            # 登录失败时关闭已建立的连接，避免泄漏
+            smtp.close()
+            raise
+        # 登录成功后才缓存连接
+        _SMTP_CLIENT = smtp
+    return _SMTP_CLIENT
+
+
+@asynccontextmanager
+async def _lifespan(server: FastMCP):
+    """
+    服务器生命周期管理，关闭时释放HTTP客户端、LLM客户端和SMTP连接
+    """
+    global _HTTPX_CLIENT, _OAI_CLIENT, _SMTP_CLIENT
+    try:
+        yield
+    finally:
+        if _HTTPX_CLIENT is not None:
+            await _HTTPX_CLIENT.aclose()
+            _HTTPX_CLIENT = None
+        if _OAI_CLIENT is not None:
+            await _OAI_CLIENT.close()
+            _OAI_CLIENT = None
+        if _SMTP_CLIENT is not None and _SMTP_CLIENT.is_connected:
+            await _SMTP_CLIENT.quit()
+        _SMTP_CLIENT = None
+
+
+mcp = FastMCP("NewsServer", lifespan=_lifespan)
+
+# 已创建过的输出目录，避免每次调用重复创建
+_ENSURED_DIRS: set[str] = set()
+
+
+def _ensure_dir(path: str) -> None:
+    """
+    确保目录存在，每个目录在进程内只创建一次
+    :param path: 目录路径
+    """
+    if path not in _ENSURED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _ENSURED_DIRS.add(path)
+
+
+def _attach_file(msg: EmailMessage, file_path: str, file_name: str) -> None:
+    """
+    以内存映射方式读取文件并添加为邮件附件（阻塞，需在线程中调用）
+    附件在添加时即完成base64编码，避免先把整个文件复制为bytes
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # 空文件无法建立内存映射
+            msg.add_attachment(b"", maintype="application", subtype="octet-stream", filename=file_name)
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as data:
+            msg.add_attachment(data, maintype="application", subtype="octet-stream", filename=file_name)
+
+
+async def _send_message(smtp_server: str, smtp_port: int, sender_email: str, sender_pass: str,
+                        msg: EmailMessage) -> None:
+    """
+    通过复用的SMTP连接发送邮件
+    """
+    global _SMTP_CLIENT
+    async with _SMTP_LOCK:
+        try:
+            smtp = await _smtp(smtp_server, smtp_port, sender_email, sender_pass)
+            await smtp.send_message(msg)
+        except aiosmtplib.SMTPServerDisconnected:
+            # 长连接已被服务器断开，重新连接后重试一次
+            _SMTP_CLIENT = None
+            smtp = await _smtp(smtp_server, smtp_port, sender_email, sender_pass)
+            await smtp.send_message(msg)
 
 
 @mcp.tool()
@@ -33,11 +145,11 @@ async def search_google_news(keywords: str) -> str:
     payload = {
         "q": keywords
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=payload)
-        data = response.json()
+    response = await _client().post(url, headers=headers, json=payload)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
     # 检查数据，按格式返回前5条新闻
-    if "news" in data:
+    if "news" not in data:
         return "未获取到搜索结果。"
     articles = [
         {
@@ -48,14 +160,14 @@ async def search_google_news(keywords: str) -> str:
     ]
     # 将搜索结果以JSON格式保存到本地
     output_dir = "./google_news"
-    os.makedirs(output_dir, exist_ok=True)
+    _ensure_dir(output_dir)
     file_name = f"google_news_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
     file_path = os.path.join(output_dir, file_name)
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(articles, f, ensure_ascii=False, indent=2)
+    articles_json = orjson.dumps(articles, option=orjson.OPT_INDENT_2)
+    await asyncio.to_thread(Path(file_path).write_bytes, articles_json)
     return (
         f"已获取与[{keywords}]相关的前5条Google新闻：\n"
-        f"{json.dumps(articles, ensure_ascii=False, indent=2)}\n"
+        f"{articles_json.decode()}\n"
         f"结果已保存到文件：{file_path}"
     )
 
@@ -68,24 +180,25 @@ async def analyze_sentiment(text: str, file_name: str) -> str:
     :param file_name: 给定文件名
     :return: 完整文件路径（用于邮件发送）
     """
-    # 情感分析功能用LLM实现，需调用OpenAI API
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    base_url = os.getenv("BASE_URL")
-    model = os.getenv("MODEL")
-    client = OpenAI(api_key=openai_api_key, base_url=base_url)
-    # 情感分析提示词
+    # 情感分析功能用LLM实现，情感分析提示词
     prompt = f"请根据以下新闻内容进行情绪倾向分析，并说明原因：\n\n{text}"
     # 调用LLM API
-    response = client.chat.completions.create(
-        model=model,
+    stream = await _llm_client().chat.completions.create(
+        model=_MODEL,
         messages=[
             {"role": "user", "content": prompt}
         ],
+        stream=True,
     )
-    result = response.choices[0].message.content
+    parts = []
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+    result = "".join(parts)
     # 保存结果
+    now = datetime.now()
     markdown = f"""# 新闻情绪倾向分析报告
-    **分析时间：** {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    **分析时间：** {now:%Y-%m-%d %H:%M:%S}
     ---
     ## 新闻内容：
     {text}
@@ -94,12 +207,11 @@ async def analyze_sentiment(text: str, file_name: str) -> str:
     {result}
     """
     output_dir = "./sentiment_report"
-    os.makedirs(output_dir, exist_ok=True)
+    _ensure_dir(output_dir)
     if not file_name:
-        file_name = f"sentiment_report_{datetime.now().strftime('%Y%m%d%H%M%S')}.md"
+        file_name = f"sentiment_report_{now:%Y%m%d%H%M%S}.md"
     file_path = os.path.join(output_dir, file_name)
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(markdown)
+    await asyncio.to_thread(Path(file_path).write_text, markdown, encoding="utf-8")
     return file_path
 
 
@@ -129,15 +241,11 @@ async def send_email_with_attachment(to: str, subject: str, body: str, file_name
     msg.set_content(body)
     # 添加附件并发送邮件
     try:
-        with open(file_path, "rb") as f:
-            file_data = f.read()
-            msg.add_attachment(file_data, maintype="application", subtype="octet-stream", filename=file_name)
+        await asyncio.to_thread(_attach_file, msg, file_path, file_name)
     except Exception as e:
         return f"添加附件失败：{str(e)}"
     try:
-        with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-            server.login(sender_email, sender_pass)
-            server.send_message(msg)
+        await _send_message(smtp_server, smtp_port, sender_email, sender_pass, msg)
         return f"邮件已成功发送给{to}，附件为{file_path}"
     except Exception as e:
         return f"邮件发送失败：{str(e)}"